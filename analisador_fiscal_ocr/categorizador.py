@@ -2,32 +2,281 @@
 Módulo para categorização de despesas baseado na descrição do CNAE.
 """
 
-import requests
+import asyncio
+import json
+import time
+from pathlib import Path
 
+import aiohttp
 
-def consultar_cnpj_brasilapi(cnpj):
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick é opcional; sem ele usamos a busca simples
+    ahocorasick = None
+
+
+# Dicionário de categorização baseado em palavras-chave
+_CATEGORIAS = {
+    "Alimentação": [
+        "restaurante", "lanchonete", "padaria", "confeitaria", "pizzaria",
+        "hamburgueria", "sorveteria", "açaí", "comida", "alimento",
+        "bebida", "bar", "pub", "cervejaria", "cafeteria", "café",
+        "pastelaria", "doceria", "panificação", "mercearia", "supermercado",
+        "hipermercado", "minimercado", "empório", "delicatessen"
+    ],
+    
+    "Transporte": [
+        "taxi", "uber", "transporte", "combustível", "gasolina", "etanol",
+        "diesel", "posto", "estacionamento", "pedágio", "ônibus",
+        "metrô", "trem", "avião", "passagem", "locação de veículos",
+        "aluguel de carros", "moto", "bicicleta"
+    ],
+    
+    "Hospedagem": [
+        "hotel", "pousada", "hostel", "motel", "resort", "hospedagem",
+        "alojamento", "pensão", "apart-hotel", "flat"
+    ],
+    
+    "Saúde": [
+        "farmácia", "drogaria", "medicamento", "hospital", "clínica",
+        "consultório", "médico", "dentista", "laboratório", "exame",
+        "fisioterapia", "psicologia", "veterinário", "ótica", "óculos"
+    ],
+    
+    "Educação": [
+        "escola", "universidade", "faculdade", "curso", "treinamento",
+        "educação", "ensino", "livraria", "papelaria", "material escolar",
+        "biblioteca", "seminário", "workshop"
+    ],
+    
+    "Tecnologia": [
+        "informática", "computador", "software", "hardware", "eletrônico",
+        "celular", "smartphone", "tablet", "notebook", "impressora",
+        "internet", "telecomunicações", "telefonia", "dados"
+    ],
+    
+    "Vestuário": [
+        "roupa", "vestuário", "calçado", "sapato", "tênis", "sandália",
+        "confecção", "moda", "boutique", "loja de roupas", "alfaiataria",
+        "sapataria", "acessórios"
+    ],
+    
+    "Serviços": [
+        "consultoria", "advocacia", "contabilidade", "auditoria",
+        "engenharia", "arquitetura", "design", "publicidade", "marketing",
+        "limpeza", "segurança", "manutenção", "reparo", "instalação"
+    ],
+    
+    "Entretenimento": [
+        "cinema", "teatro", "show", "evento", "festa", "entretenimento",
+        "diversão", "parque", "museu", "exposição", "jogo", "esporte",
+        "academia", "ginástica", "clube", "recreação"
+    ],
+    
+    "Material de Escritório": [
+        "papelaria", "escritório", "material de escritório", "impressão",
+        "gráfica", "fotocópia", "encadernação", "papel", "caneta",
+        "arquivo", "pasta", "organizador"
+    ]
+}
+
+
+def _construir_automato(categorias):
+    """
+    Monta um autômato Aho-Corasick com todas as palavras-chave.
+    
+    Cada palavra guarda o índice da sua categoria; como o autômato encontra
+    todas as ocorrências (inclusive sobrepostas), a categoria de menor índice
+    encontrada é a mesma que a busca palavra a palavra retornaria.
+    
+    Args:
+        categorias (dict): Categoria: lista de palavras-chave
+        
+    Returns:
+        ahocorasick.Automaton: Autômato pronto para busca
+    """
+    automato = ahocorasick.Automaton()
+    for indice, palavras_chave in enumerate(categorias.values()):
+        for palavra in palavras_chave:
+            # Palavras repetidas ficam com a primeira categoria em que aparecem
+            if palavra not in automato:
+                automato.add_word(palavra, indice)
+    automato.make_automaton()
+    return automato
+
+
+_AUTOMATO = _construir_automato(_CATEGORIAS) if ahocorasick else None
+_NOMES_CATEGORIAS = list(_CATEGORIAS)
+
+
+def _gerar_despachante(categorias):
+    """
+    Gera uma função com os testes de palavra-chave escritos em sequência.
+    
+    Equivale a percorrer as categorias e palavras em ordem, mas sem os laços
+    e buscas em dicionário a cada chamada. Usada quando o pyahocorasick não
+    está instalado.
+    
+    Args:
+        categorias (dict): Categoria: lista de palavras-chave
+        
+    Returns:
+        function: Recebe a descrição em minúsculas e retorna a categoria
+    """
+    codigo = ["def _despachar(descricao):"]
+    for categoria, palavras_chave in categorias.items():
+        condicao = " or ".join(f"{palavra.lower()!r} in descricao" for palavra in palavras_chave)
+        codigo.append(f"    if {condicao}:")
+        codigo.append(f"        return {categoria!r}")
+    codigo.append("    return 'Outros'")
+    
+    namespace = {}
+    exec("\n".join(codigo), namespace)
+    return namespace["_despachar"]
+
+
+_DESPACHAR_CATEGORIA = _gerar_despachante(_CATEGORIAS) if _AUTOMATO is None else None
+
+# Cache em disco das consultas à BrasilAPI (dados de CNPJ mudam raramente)
+ARQUIVO_CACHE_CNPJ = Path(".cnpj_cache.json")
+VALIDADE_CACHE_CNPJ = 30 * 24 * 60 * 60  # 30 dias, em segundos
+
+_cache_cnpj = None
+
+
+def _carregar_cache_cnpj():
+    """
+    Carrega o cache de CNPJs do disco (apenas na primeira chamada).
+    
+    Returns:
+        dict: CNPJ: {'dados': resposta da BrasilAPI, 'consultado_em': timestamp}
+    """
+    global _cache_cnpj
+    
+    if _cache_cnpj is None:
+        try:
+            with open(ARQUIVO_CACHE_CNPJ, 'r', encoding='utf-8') as f:
+                _cache_cnpj = json.load(f)
+        except (OSError, ValueError):
+            _cache_cnpj = {}
+        
+        # Arquivo com formato inesperado é descartado
+        if not isinstance(_cache_cnpj, dict):
+            _cache_cnpj = {}
+    
+    return _cache_cnpj
+
+
+def _salvar_cache_cnpj():
+    """Grava o cache de CNPJs no disco."""
+    try:
+        with open(ARQUIVO_CACHE_CNPJ, 'w', encoding='utf-8') as f:
+            json.dump(_cache_cnpj, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"  ⚠️  Não foi possível salvar o cache de CNPJs: {str(e)}")
+
+
+def _entrada_cache_valida(entrada):
+    """Indica se uma entrada do cache tem o formato gravado por esta versão."""
+    return (
+        isinstance(entrada, dict)
+        and isinstance(entrada.get('dados'), dict)
+        and isinstance(entrada.get('consultado_em', 0), (int, float))
+    )
+
+
+# Novas tentativas para falhas temporárias da BrasilAPI (espera 0.2s, 0.4s, 0.8s)
+STATUS_NOVA_TENTATIVA = {429, 500, 502, 503, 504}
+MAX_NOVAS_TENTATIVAS = 3
+FATOR_ESPERA = 0.2
+
+
+async def consultar_cnpj_brasilapi(session, cnpj):
     """
     Consulta informações de um CNPJ na BrasilAPI.
     
+    Erros de conexão, timeouts e respostas 429/5xx são repetidos até
+    MAX_NOVAS_TENTATIVAS vezes, com espera exponencial entre as tentativas.
+    
     Args:
+        session (aiohttp.ClientSession): Sessão HTTP compartilhada entre as consultas
         cnpj (str): CNPJ com 14 dígitos (apenas números)
         
     Returns:
         dict: Informações da empresa ou None se não encontrado
     """
-    try:
-        url = f"https://brasilapi.com.br/api/cnpj/v1/{cnpj}"
-        response = requests.get(url, timeout=10)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"  ⚠️  CNPJ {cnpj} não encontrado na BrasilAPI")
-            return None
-            
-    except requests.exceptions.RequestException as e:
-        print(f"  ❌ Erro ao consultar CNPJ {cnpj}: {str(e)}")
-        return None
+    url = f"https://brasilapi.com.br/api/cnpj/v1/{cnpj}"
+    
+    for tentativa in range(MAX_NOVAS_TENTATIVAS + 1):
+        ultima_tentativa = tentativa == MAX_NOVAS_TENTATIVAS
+        
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return await response.json()
+                elif response.status not in STATUS_NOVA_TENTATIVA:
+                    print(f"  ⚠️  CNPJ {cnpj} não encontrado na BrasilAPI")
+                    return None
+                elif ultima_tentativa:
+                    print(f"  ❌ BrasilAPI indisponível ao consultar CNPJ {cnpj} (HTTP {response.status})")
+                    return None
+                
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if ultima_tentativa:
+                print(f"  ❌ Erro ao consultar CNPJ {cnpj}: {str(e)}")
+                return None
+        
+        await asyncio.sleep(FATOR_ESPERA * 2 ** tentativa)
+
+
+async def consultar_cnpjs_em_lote(cnpjs):
+    """
+    Consulta vários CNPJs na BrasilAPI em paralelo.
+    
+    CNPJs consultados nos últimos 30 dias são lidos do cache em disco; apenas
+    os demais vão para a API.
+    
+    Args:
+        cnpjs (list): Lista de CNPJs com 14 dígitos (apenas números)
+        
+    Returns:
+        list: Informações de cada empresa (ou None), na mesma ordem de `cnpjs`
+    """
+    cache = _carregar_cache_cnpj()
+    agora = time.time()
+    
+    # CNPJs repetidos são consultados uma única vez
+    pendentes = [
+        cnpj for cnpj in dict.fromkeys(cnpjs)
+        if not _entrada_cache_valida(cache.get(cnpj))
+        or agora - cache[cnpj].get('consultado_em', 0) > VALIDADE_CACHE_CNPJ
+    ]
+    
+    if pendentes:
+        conector = aiohttp.TCPConnector(limit=32)
+        timeout = aiohttp.ClientTimeout(total=10)
+        
+        async with aiohttp.ClientSession(connector=conector, timeout=timeout) as session:
+            resultados = await asyncio.gather(
+                *[consultar_cnpj_brasilapi(session, cnpj) for cnpj in pendentes],
+                return_exceptions=True
+            )
+        
+        # Falhas inesperadas em uma consulta não derrubam as demais
+        novos = {
+            cnpj: {'dados': dados, 'consultado_em': agora}
+            for cnpj, dados in zip(pendentes, resultados)
+            if dados and not isinstance(dados, BaseException)
+        }
+        
+        if novos:
+            cache.update(novos)
+            _salvar_cache_cnpj()
+    
+    return [
+        cache[cnpj]['dados'] if _entrada_cache_valida(cache.get(cnpj)) else None
+        for cnpj in cnpjs
+    ]
 
 
 def categorizar_por_cnae(descricao_cnae):
@@ -45,76 +294,14 @@ def categorizar_por_cnae(descricao_cnae):
     
     descricao_lower = descricao_cnae.lower()
     
-    # Dicionário de categorização baseado em palavras-chave
-    categorias = {
-        "Alimentação": [
-            "restaurante", "lanchonete", "padaria", "confeitaria", "pizzaria",
-            "hamburgueria", "sorveteria", "açaí", "comida", "alimento",
-            "bebida", "bar", "pub", "cervejaria", "cafeteria", "café",
-            "pastelaria", "doceria", "panificação", "mercearia", "supermercado",
-            "hipermercado", "minimercado", "empório", "delicatessen"
-        ],
-        
-        "Transporte": [
-            "taxi", "uber", "transporte", "combustível", "gasolina", "etanol",
-            "diesel", "posto", "estacionamento", "pedágio", "ônibus",
-            "metrô", "trem", "avião", "passagem", "locação de veículos",
-            "aluguel de carros", "moto", "bicicleta"
-        ],
-        
-        "Hospedagem": [
-            "hotel", "pousada", "hostel", "motel", "resort", "hospedagem",
-            "alojamento", "pensão", "apart-hotel", "flat"
-        ],
-        
-        "Saúde": [
-            "farmácia", "drogaria", "medicamento", "hospital", "clínica",
-            "consultório", "médico", "dentista", "laboratório", "exame",
-            "fisioterapia", "psicologia", "veterinário", "ótica", "óculos"
-        ],
-        
-        "Educação": [
-            "escola", "universidade", "faculdade", "curso", "treinamento",
-            "educação", "ensino", "livraria", "papelaria", "material escolar",
-            "biblioteca", "seminário", "workshop"
-        ],
-        
-        "Tecnologia": [
-            "informática", "computador", "software", "hardware", "eletrônico",
-            "celular", "smartphone", "tablet", "notebook", "impressora",
-            "internet", "telecomunicações", "telefonia", "dados"
-        ],
-        
-        "Vestuário": [
-            "roupa", "vestuário", "calçado", "sapato", "tênis", "sandália",
-            "confecção", "moda", "boutique", "loja de roupas", "alfaiataria",
-            "sapataria", "acessórios"
-        ],
-        
-        "Serviços": [
-            "consultoria", "advocacia", "contabilidade", "auditoria",
-            "engenharia", "arquitetura", "design", "publicidade", "marketing",
-            "limpeza", "segurança", "manutenção", "reparo", "instalação"
-        ],
-        
-        "Entretenimento": [
-            "cinema", "teatro", "show", "evento", "festa", "entretenimento",
-            "diversão", "parque", "museu", "exposição", "jogo", "esporte",
-            "academia", "ginástica", "clube", "recreação"
-        ],
-        
-        "Material de Escritório": [
-            "papelaria", "escritório", "material de escritório", "impressão",
-            "gráfica", "fotocópia", "encadernação", "papel", "caneta",
-            "arquivo", "pasta", "organizador"
-        ]
-    }
-    
-    # Verifica cada categoria
-    for categoria, palavras_chave in categorias.items():
-        for palavra in palavras_chave:
-            if palavra in descricao_lower:
-                return categoria
+    if _AUTOMATO is None:
+        return _DESPACHAR_CATEGORIA(descricao_lower)
+    
+    # Encontra todas as palavras-chave em uma única passada pela descrição
+    indice = min((i for _, i in _AUTOMATO.iter(descricao_lower)), default=None)
+    
+    if indice is not None:
+        return _NOMES_CATEGORIAS[indice]
     
     return "Outros"
 
@@ -134,7 +321,7 @@ def processar_cnpj_e_categorizar(cnpj):
     
     print(f"  🔍 Consultando CNPJ: {cnpj}")
     
-    dados_empresa = consultar_cnpj_brasilapi(cnpj)
+    dados_empresa = asyncio.run(consultar_cnpjs_em_lote([cnpj]))[0]
     
     if not dados_empresa:
         return "Outros", "Empresa não encontrada", "CNAE não disponível"
@@ -154,6 +341,8 @@ def processar_cnpj_e_categorizar(cnpj):
 class CategorizadorDespesas:
     """Classe para categorização de despesas baseada em CNPJ e CNAE."""
     
+    __slots__ = ()
+    
     def __init__(self):
         """Inicializa o categorizador."""
         pass
@@ -168,7 +357,27 @@ class CategorizadorDespesas:
         Returns:
             Dicionário com informações da empresa ou None
         """
-        dados = consultar_cnpj_brasilapi(cnpj)
+        return self.consultar_cnpjs([cnpj])[0]
+    
+    def consultar_cnpjs(self, cnpjs):
+        """
+        Consulta vários CNPJs na BrasilAPI em paralelo.
+        
+        Args:
+            cnpjs: Lista de CNPJs com 14 dígitos
+            
+        Returns:
+            Lista com as informações de cada empresa (ou None), na mesma ordem
+        """
+        if not cnpjs:
+            return []
+        
+        resultados = asyncio.run(consultar_cnpjs_em_lote(cnpjs))
+        return [self._resumir_dados(dados) for dados in resultados]
+    
+    @staticmethod
+    def _resumir_dados(dados):
+        """Extrai da resposta da BrasilAPI os campos usados na categorização."""
         if dados:
             return {
                 'nome': dados.get('razao_social', 'Nome não disponível'),
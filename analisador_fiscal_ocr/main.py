@@ -6,15 +6,21 @@ Automatiza a análise de canhotos de maquininha usando AWS Textract para OCR.
 
 import os
 import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 # Adiciona o diretório do projeto ao path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from analisador_fiscal_ocr.ocr_aws import extrair_dados_canhoto_aws
+from analisador_fiscal_ocr.ocr_aws import OCRAws
 from analisador_fiscal_ocr.categorizador import CategorizadorDespesas, categorizar_por_cnae
 
 
+# Extensões de imagem suportadas
+_EXTENSOES_IMAGEM = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif'}
+
+
 def encontrar_imagens_canhotos(pasta_canhotos="canhotos"):
     """
     Encontra todas as imagens de canhotos na pasta especificada.
@@ -32,117 +38,150 @@ def encontrar_imagens_canhotos(pasta_canhotos="canhotos"):
         print(f"💡 Crie a pasta e adicione as imagens dos canhotos.")
         return []
     
-    # Extensões de imagem suportadas
-    extensoes = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif']
-    imagens = []
-    
-    for ext in extensoes:
-        imagens.extend(pasta.glob(f"*{ext}"))
-        imagens.extend(pasta.glob(f"*{ext.upper()}"))
-    
-    return sorted(imagens)
+    # Lê a pasta uma única vez, filtrando pela extensão (sem diferenciar maiúsculas)
+    return sorted(p for p in pasta.iterdir() if p.suffix.lower() in _EXTENSOES_IMAGEM)
 
 
-def processar_canhotos(imagens, region_name='us-east-1'):
+def processar_canhotos(imagens, region_name='us-east-1', max_workers=10, bucket_s3=None):
     """
     Processa uma lista de imagens de canhotos.
     
     Args:
         imagens: Lista de caminhos para as imagens
         region_name: Região AWS para usar o Textract
+        max_workers: Número máximo de chamadas simultâneas ao Textract
+        bucket_s3: Bucket S3 para usar a API assíncrona do Textract (opcional)
         
     Returns:
         Lista de dicionários com os dados extraídos
     """
-    resultados = []
+    resultados = [None] * len(imagens)
     categorizador = CategorizadorDespesas()
+    ocr = OCRAws(region_name=region_name, bucket_s3=bucket_s3)
     
     print(f"🔍 Encontradas {len(imagens)} imagens para processar")
     print("=" * 60)
     
-    for i, caminho_imagem in enumerate(imagens, 1):
-        print(f"\n📸 [{i}/{len(imagens)}] Processando imagem...")
+    # Dispara as chamadas ao Textract em paralelo (o cliente boto3 é thread-safe).
+    # As threads não imprimem nada; a saída de cada imagem é exibida aqui, em bloco.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(ocr.extrair_dados_canhoto, str(caminho_imagem), exibir=False): i
+            for i, caminho_imagem in enumerate(imagens)
+        }
         
-        try:
-            # Extrai dados usando AWS Textract
-            dados = extrair_dados_canhoto_aws(str(caminho_imagem), region_name)
+        for concluidas, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            caminho_imagem = imagens[i]
+            print(f"\n📸 [{concluidas}/{len(imagens)}] {caminho_imagem.name}")
             
-            if dados['cnpj']:
-                # Consulta informações da empresa
-                print(f"  🔍 Consultando CNPJ: {dados['cnpj']}")
-                info_empresa = categorizador.consultar_cnpj(dados['cnpj'])
+            try:
+                dados = future.result()
                 
-                if info_empresa:
-                    print(f"  🏢 Empresa: {info_empresa['nome']}")
-                    print(f"  📋 CNAE: {info_empresa['atividade_principal']}")
-                    
-                    # Categoriza a despesa
-                    categoria = categorizar_por_cnae(info_empresa['atividade_principal'])
-                    print(f"  🏷️  Categoria: {categoria}")
-                    
-                    dados.update({
-                        'empresa': info_empresa['nome'],
-                        'atividade': info_empresa['atividade_principal'],
-                        'categoria': categoria
-                    })
+                if dados['texto_completo']:
+                    print(f"  📄 CNPJ: {dados['cnpj'] if dados['cnpj'] else 'Não encontrado'}")
+                    print(f"  💰 Valor: R$ {dados['valor']:.2f}")
                 else:
-                    print(f"  ⚠️  Não foi possível consultar informações da empresa")
+                    print(f"  ⚠️  Não foi possível extrair texto da imagem")
+                
+                if not dados['cnpj']:
                     dados.update({
-                        'empresa': 'Não identificada',
+                        'empresa': 'CNPJ não encontrado',
                         'atividade': 'Não identificada',
                         'categoria': 'Outros'
                     })
-            else:
-                dados.update({
-                    'empresa': 'CNPJ não encontrado',
-                    'atividade': 'Não identificada',
-                    'categoria': 'Outros'
-                })
+                
+                dados['arquivo'] = caminho_imagem.name
+                resultados[i] = dados
+                print(f"  ✅ Processado com sucesso!")
+                
+            except Exception as e:
+                print(f"  ❌ Erro ao processar: {str(e)}")
+                # Adiciona resultado com erro
+                resultados[i] = {
+                    'arquivo': caminho_imagem.name,
+                    'cnpj': None,
+                    'valor': 0.0,
+                    'empresa': 'Erro no processamento',
+                    'atividade': 'Erro',
+                    'categoria': 'Outros',
+                    'texto_completo': ''
+                }
+    
+    # Consulta cada CNPJ uma única vez na BrasilAPI (vários canhotos podem ser do mesmo estabelecimento)
+    canhotos_com_cnpj = [dados for dados in resultados if dados['cnpj']]
+    cnpjs_unicos = list(dict.fromkeys(dados['cnpj'] for dados in canhotos_com_cnpj))
+    
+    if cnpjs_unicos:
+        print(f"\n🔍 Consultando {len(cnpjs_unicos)} CNPJs na BrasilAPI...")
+        infos_por_cnpj = dict(zip(cnpjs_unicos, categorizador.consultar_cnpjs(cnpjs_unicos)))
+    else:
+        infos_por_cnpj = {}
+    
+    infos_empresas = [infos_por_cnpj[dados['cnpj']] for dados in canhotos_com_cnpj]
+    
+    for dados, info_empresa in zip(canhotos_com_cnpj, infos_empresas):
+        print(f"\n📄 {dados['arquivo']} - CNPJ: {dados['cnpj']}")
+        
+        if info_empresa:
+            print(f"  🏢 Empresa: {info_empresa['nome']}")
+            print(f"  📋 CNAE: {info_empresa['atividade_principal']}")
             
-            dados['arquivo'] = caminho_imagem.name
-            resultados.append(dados)
-            print(f"  ✅ Processado com sucesso!")
+            # Categoriza a despesa
+            categoria = categorizar_por_cnae(info_empresa['atividade_principal'])
+            print(f"  🏷️  Categoria: {categoria}")
             
-        except Exception as e:
-            print(f"  ❌ Erro ao processar: {str(e)}")
-            # Adiciona resultado com erro
-            resultados.append({
-                'arquivo': caminho_imagem.name,
-                'cnpj': None,
-                'valor': 0.0,
-                'empresa': 'Erro no processamento',
-                'atividade': 'Erro',
-                'categoria': 'Outros',
-                'texto_completo': ''
+            dados.update({
+                'empresa': info_empresa['nome'],
+                'atividade': info_empresa['atividade_principal'],
+                'categoria': categoria
+            })
+        else:
+            print(f"  ⚠️  Não foi possível consultar informações da empresa")
+            dados.update({
+                'empresa': 'Não identificada',
+                'atividade': 'Não identificada',
+                'categoria': 'Outros'
             })
     
     return resultados
 
 
-def gerar_relatorio(resultados):
+def agrupar_gastos_por_categoria(resultados):
+    """
+    Soma os valores dos canhotos por categoria.
+    
+    Args:
+        resultados: Lista de resultados do processamento
+        
+    Returns:
+        Dicionário com categoria: valor total
+    """
+    gastos_por_categoria = defaultdict(float)
+    
+    for resultado in resultados:
+        gastos_por_categoria[resultado.get('categoria', 'Outros')] += resultado.get('valor', 0.0)
+    
+    return dict(gastos_por_categoria)
+
+
+def gerar_relatorio(resultados, gastos_por_categoria=None):
     """
     Gera relatório de gastos por categoria.
     
     Args:
         resultados: Lista de resultados do processamento
+        gastos_por_categoria: Gastos já agrupados por categoria (opcional)
     """
     print("\n" + "=" * 60)
     print("📊 RELATÓRIO DE GASTOS POR CATEGORIA")
     print("=" * 60)
     
     # Agrupa por categoria
-    gastos_por_categoria = {}
-    total_geral = 0.0
+    if gastos_por_categoria is None:
+        gastos_por_categoria = agrupar_gastos_por_categoria(resultados)
     
-    for resultado in resultados:
-        categoria = resultado.get('categoria', 'Outros')
-        valor = resultado.get('valor', 0.0)
-        
-        if categoria not in gastos_por_categoria:
-            gastos_por_categoria[categoria] = 0.0
-        
-        gastos_por_categoria[categoria] += valor
-        total_geral += valor
+    total_geral = sum(r.get('valor', 0.0) for r in resultados)
     
     print(f"💰 TOTAL GERAL: R$ {total_geral:.2f}")
     
@@ -165,49 +204,56 @@ def gerar_relatorio(resultados):
     print("=" * 60)
 
 
-def salvar_relatorio_detalhado(resultados, nome_arquivo="relatorio_fiscal.txt"):
+def salvar_relatorio_detalhado(resultados, nome_arquivo="relatorio_fiscal.txt", gastos_por_categoria=None):
     """
     Salva relatório detalhado em arquivo.
     
     Args:
         resultados: Lista de resultados do processamento
         nome_arquivo: Nome do arquivo para salvar
+        gastos_por_categoria: Gastos já agrupados por categoria (opcional)
     """
     try:
+        relatorio = []
+        relatorio.append("RELATÓRIO FISCAL DETALHADO")
+        relatorio.append("=" * 50)
+        relatorio.append("")
+        
+        total_geral = sum(r.get('valor', 0.0) for r in resultados)
+        relatorio.append(f"TOTAL GERAL: R$ {total_geral:.2f}")
+        relatorio.append(f"TOTAL DE CANHOTOS: {len(resultados)}")
+        relatorio.append("")
+        
+        # Detalhes por canhoto
+        relatorio.append("DETALHES POR CANHOTO:")
+        relatorio.append("-" * 50)
+        
+        for i, resultado in enumerate(resultados, 1):
+            relatorio.append("")
+            relatorio.append(f"{i}. {resultado['arquivo']}")
+            relatorio.append(f"   CNPJ: {resultado.get('cnpj', 'Não encontrado')}")
+            relatorio.append(f"   Empresa: {resultado.get('empresa', 'N/A')}")
+            relatorio.append(f"   Valor: R$ {resultado.get('valor', 0.0):.2f}")
+            relatorio.append(f"   Categoria: {resultado.get('categoria', 'N/A')}")
+            relatorio.append(f"   Atividade: {resultado.get('atividade', 'N/A')}")
+        
+        # Resumo por categoria
+        if gastos_por_categoria is None:
+            gastos_por_categoria = agrupar_gastos_por_categoria(resultados)
+        
+        relatorio.append("")
+        relatorio.append("")
+        relatorio.append("RESUMO POR CATEGORIA:")
+        relatorio.append("-" * 50)
+        
+        for categoria, valor in sorted(gastos_por_categoria.items(), key=lambda x: x[1], reverse=True):
+            if valor > 0:
+                percentual = (valor / total_geral) * 100 if total_geral > 0 else 0
+                relatorio.append(f"{categoria}: R$ {valor:.2f} ({percentual:.1f}%)")
+        
+        # Grava o relatório inteiro de uma vez
         with open(nome_arquivo, 'w', encoding='utf-8') as f:
-            f.write("RELATÓRIO FISCAL DETALHADO\n")
-            f.write("=" * 50 + "\n\n")
-            
-            total_geral = sum(r.get('valor', 0.0) for r in resultados)
-            f.write(f"TOTAL GERAL: R$ {total_geral:.2f}\n")
-            f.write(f"TOTAL DE CANHOTOS: {len(resultados)}\n\n")
-            
-            # Detalhes por canhoto
-            f.write("DETALHES POR CANHOTO:\n")
-            f.write("-" * 50 + "\n")
-            
-            for i, resultado in enumerate(resultados, 1):
-                f.write(f"\n{i}. {resultado['arquivo']}\n")
-                f.write(f"   CNPJ: {resultado.get('cnpj', 'Não encontrado')}\n")
-                f.write(f"   Empresa: {resultado.get('empresa', 'N/A')}\n")
-                f.write(f"   Valor: R$ {resultado.get('valor', 0.0):.2f}\n")
-                f.write(f"   Categoria: {resultado.get('categoria', 'N/A')}\n")
-                f.write(f"   Atividade: {resultado.get('atividade', 'N/A')}\n")
-            
-            # Resumo por categoria
-            gastos_por_categoria = {}
-            for resultado in resultados:
-                categoria = resultado.get('categoria', 'Outros')
-                valor = resultado.get('valor', 0.0)
-                gastos_por_categoria[categoria] = gastos_por_categoria.get(categoria, 0.0) + valor
-            
-            f.write(f"\n\nRESUMO POR CATEGORIA:\n")
-            f.write("-" * 50 + "\n")
-            
-            for categoria, valor in sorted(gastos_por_categoria.items(), key=lambda x: x[1], reverse=True):
-                if valor > 0:
-                    percentual = (valor / total_geral) * 100 if total_geral > 0 else 0
-                    f.write(f"{categoria}: R$ {valor:.2f} ({percentual:.1f}%)\n")
+            f.write("\n".join(relatorio) + "\n")
         
         print(f"📄 Relatório detalhado salvo em: {nome_arquivo}")
         
@@ -250,14 +296,22 @@ def main():
         if not region_name:
             region_name = 'us-east-1'
     
+    # Bucket S3 opcional para processar os canhotos com a API assíncrona do Textract
+    bucket_s3 = os.environ.get('TEXTRACT_S3_BUCKET') or None
+    if bucket_s3:
+        print(f"🪣 Usando bucket S3: {bucket_s3}")
+    
     # Processa canhotos
-    resultados = processar_canhotos(imagens, region_name)
+    resultados = processar_canhotos(imagens, region_name, bucket_s3=bucket_s3)
+    
+    # Agrupa os gastos uma única vez para os dois relatórios
+    gastos_por_categoria = agrupar_gastos_por_categoria(resultados)
     
     # Gera relatório
-    gerar_relatorio(resultados)
+    gerar_relatorio(resultados, gastos_por_categoria)
     
     # Salva relatório detalhado
-    salvar_relatorio_detalhado(resultados)
+    salvar_relatorio_detalhado(resultados, gastos_por_categoria=gastos_por_categoria)
     
     print(f"\n✅ Processamento concluído!")
     print(f"📊 {len(resultados)} canhotos processados")
@@ -4,22 +4,88 @@ Substitui OCR local por serviço em nuvem da AWS para maior precisão.
 """
 
 import boto3
+import functools
+import mmap
 import re
 import os
+import time
+import uuid
 from typing import Dict, Optional
 import base64
 
 
+# Padrões para CNPJ (em ordem de prioridade)
+_PADROES_CNPJ = [re.compile(padrao, re.IGNORECASE | re.MULTILINE) for padrao in (
+    # CNPJ formatado completo
+    r'CNPJ[:\s]*(\d{2}\.?\d{3}\.?\d{3}\/?\d{4}-?\d{2})',
+    # CNPJ sem formatação após palavra CNPJ
+    r'CNPJ[:\s]*(\d{14})',
+    # Sequência de 14 dígitos isolada
+    r'(?:^|\s)(\d{14})(?:\s|$)',
+    # Padrão formatado isolado
+    r'(\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2})',
+)]
+
+# Padrões para valores monetários
+_PADROES_VALOR = [re.compile(padrao, re.IGNORECASE) for padrao in (
+    # Padrões com palavras-chave
+    r'(?:TOTAL|VALOR\s*TOTAL|TOTAL\s*GERAL)[:\s]*R?\$?\s*(\d{1,6}[,.]?\d{2})',
+    r'(?:TOTAL|VALOR)[:\s]*R?\$?\s*(\d{1,6}[,.]?\d{2})',
+    # Padrões com R$
+    r'R\$\s*(\d{1,6}[,.]?\d{2})',
+    r'RS\s*(\d{1,6}[,.]?\d{2})',
+    # Valores no final de linhas
+    r'(\d{1,6}[,.]?\d{2})\s*$',
+    # Valores isolados com formato monetário
+    r'(?:^|\s)(\d{1,4}[,.]\d{2})(?:\s|$)',
+)]
+
+# Contexto da linha que aumenta o peso de um valor
+_RE_TOTAL = re.compile(r'TOTAL', re.IGNORECASE)
+_RE_REAIS = re.compile(r'R\$|RS')
+
+# Trecho que todo valor monetário contém; linhas sem ele não casam com nenhum padrão
+_RE_CANDIDATO_VALOR = re.compile(r'\d[,.]?\d{2}')
+
+# Limpeza do texto antes da busca por CNPJ
+_RE_SIMBOLOS = re.compile(r'[^\w\s\.\-\/]+')
+_RE_ESPACOS = re.compile(r'\s+')
+_RE_NAO_DIGITOS = re.compile(r'\D')
+
+
+@functools.lru_cache(maxsize=8)
+def _cliente_aws(servico: str, region_name: str):
+    """
+    Retorna um cliente boto3, reaproveitado entre chamadas para a mesma região.
+    
+    Criar um cliente é caro (carrega o modelo do serviço e prepara o SSL), e
+    os clientes boto3 são thread-safe.
+    
+    Args:
+        servico: Nome do serviço AWS (ex: 'textract', 's3')
+        region_name: Região AWS
+        
+    Returns:
+        Cliente boto3 do serviço
+    """
+    return boto3.client(servico, region_name=region_name)
+
+
 class OCRAws:
-    def __init__(self, region_name='us-east-1'):
+    __slots__ = ('bucket_s3', 'textract', 's3')
+    
+    def __init__(self, region_name='us-east-1', bucket_s3: Optional[str] = None):
         """
         Inicializa o cliente AWS Textract.
         
         Args:
             region_name: Região AWS para usar o serviço
+            bucket_s3: Bucket S3 para o modo assíncrono do Textract (opcional)
         """
+        self.bucket_s3 = bucket_s3
         try:
-            self.textract = boto3.client('textract', region_name=region_name)
+            self.textract = _cliente_aws('textract', region_name)
+            self.s3 = _cliente_aws('s3', region_name) if bucket_s3 else None
             print("✅ AWS Textract inicializado!")
         except Exception as e:
             print(f"❌ Erro ao inicializar AWS Textract: {e}")
@@ -37,27 +103,95 @@ class OCRAws:
             Texto extraído da imagem
         """
         try:
-            # Lê o arquivo de imagem
-            with open(caminho_imagem, 'rb') as image_file:
-                image_bytes = image_file.read()
+            return self._detectar_texto_aws(caminho_imagem)
             
-            # Chama AWS Textract
-            response = self.textract.detect_document_text(
-                Document={'Bytes': image_bytes}
-            )
-            
-            # Extrai o texto dos blocos
-            texto_completo = []
-            for block in response['Blocks']:
-                if block['BlockType'] == 'LINE':
-                    texto_completo.append(block['Text'])
+        except Exception as e:
+            print(f"❌ Erro ao processar imagem com AWS Textract: {e}")
+            return ""
+    
+    def extrair_texto_s3(self, caminho_imagem: str, espera_maxima: float = 300) -> str:
+        """
+        Extrai texto de uma imagem usando a API assíncrona do AWS Textract.
+        
+        A imagem é enviada ao bucket S3 configurado, o job é iniciado com
+        StartDocumentTextDetection e o resultado é consultado com backoff
+        exponencial. O objeto é removido do bucket ao final.
+        
+        Args:
+            caminho_imagem: Caminho para o arquivo de imagem
+            espera_maxima: Tempo máximo (em segundos) aguardando o job
             
-            return '\n'.join(texto_completo)
+        Returns:
+            Texto extraído da imagem
+        """
+        try:
+            return self._detectar_texto_s3(caminho_imagem, espera_maxima)
             
         except Exception as e:
-            print(f"❌ Erro ao processar imagem com AWS Textract: {e}")
+            print(f"❌ Erro ao processar imagem com AWS Textract (S3): {e}")
             return ""
     
+    def _detectar_texto_aws(self, caminho_imagem: str) -> str:
+        """Chama detect_document_text com a imagem; erros são propagados."""
+        # Mapeia o arquivo em memória em vez de copiá-lo para um objeto bytes;
+        # o boto3 codifica o buffer em base64 direto do mapeamento
+        with open(caminho_imagem, 'rb') as image_file:
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image_bytes:
+                # Chama AWS Textract
+                response = self.textract.detect_document_text(
+                    Document={'Bytes': image_bytes}
+                )
+        
+        # Extrai o texto dos blocos
+        return '\n'.join(
+            block['Text'] for block in response['Blocks'] if block['BlockType'] == 'LINE'
+        )
+    
+    def _detectar_texto_s3(self, caminho_imagem: str, espera_maxima: float = 300) -> str:
+        """Processa a imagem pela API assíncrona via S3; erros são propagados."""
+        chave = f"canhotos/{uuid.uuid4().hex}-{os.path.basename(caminho_imagem)}"
+        
+        try:
+            self.s3.upload_file(caminho_imagem, self.bucket_s3, chave)
+            
+            job_id = self.textract.start_document_text_detection(
+                DocumentLocation={'S3Object': {'Bucket': self.bucket_s3, 'Name': chave}}
+            )['JobId']
+            
+            # Aguarda o job terminar (1s, 2s, 4s, ... até 16s entre consultas)
+            espera = 1
+            inicio = time.monotonic()
+            response = self.textract.get_document_text_detection(JobId=job_id)
+            while response['JobStatus'] == 'IN_PROGRESS':
+                if time.monotonic() - inicio > espera_maxima:
+                    raise TimeoutError(f"job {job_id} não terminou em {espera_maxima}s")
+                time.sleep(espera)
+                espera = min(espera * 2, 16)
+                response = self.textract.get_document_text_detection(JobId=job_id)
+            
+            if response['JobStatus'] == 'FAILED':
+                raise RuntimeError(response.get('StatusMessage', f"job {job_id} falhou"))
+            
+            # Extrai o texto dos blocos, percorrendo todas as páginas do resultado
+            texto_completo = []
+            while True:
+                for block in response['Blocks']:
+                    if block['BlockType'] == 'LINE':
+                        texto_completo.append(block['Text'])
+                if 'NextToken' not in response:
+                    break
+                response = self.textract.get_document_text_detection(
+                    JobId=job_id, NextToken=response['NextToken']
+                )
+            
+            return '\n'.join(texto_completo)
+        
+        finally:
+            try:
+                self.s3.delete_object(Bucket=self.bucket_s3, Key=chave)
+            except Exception:
+                pass
+    
     def extrair_cnpj(self, texto: str) -> Optional[str]:
         """
         Extrai CNPJ do texto usando expressões regulares.
@@ -69,26 +203,14 @@ class OCRAws:
             CNPJ encontrado (apenas números) ou None se não encontrado
         """
         # Limpa o texto
-        texto_limpo = re.sub(r'[^\w\s\.\-\/]', ' ', texto)
-        texto_limpo = re.sub(r'\s+', ' ', texto_limpo)
-        
-        # Padrões para CNPJ
-        padroes_cnpj = [
-            # CNPJ formatado completo
-            r'CNPJ[:\s]*(\d{2}\.?\d{3}\.?\d{3}\/?\d{4}-?\d{2})',
-            # CNPJ sem formatação após palavra CNPJ
-            r'CNPJ[:\s]*(\d{14})',
-            # Sequência de 14 dígitos isolada
-            r'(?:^|\s)(\d{14})(?:\s|$)',
-            # Padrão formatado isolado
-            r'(\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2})',
-        ]
-        
-        for padrao in padroes_cnpj:
-            matches = re.findall(padrao, texto_limpo, re.IGNORECASE | re.MULTILINE)
+        texto_limpo = _RE_SIMBOLOS.sub(' ', texto)
+        texto_limpo = _RE_ESPACOS.sub(' ', texto_limpo)
+        
+        for padrao in _PADROES_CNPJ:
+            matches = padrao.findall(texto_limpo)
             for match in matches:
                 # Remove formatação e mantém apenas números
-                cnpj_limpo = re.sub(r'[^\d]', '', match)
+                cnpj_limpo = _RE_NAO_DIGITOS.sub('', match)
                 # Verifica se tem exatamente 14 dígitos
                 if len(cnpj_limpo) == 14:
                     # Validação básica de CNPJ
@@ -107,20 +229,6 @@ class OCRAws:
         Returns:
             Valor total encontrado ou 0.0 se não encontrado
         """
-        # Padrões para valores monetários
-        padroes_valor = [
-            # Padrões com palavras-chave
-            r'(?:TOTAL|VALOR\s*TOTAL|TOTAL\s*GERAL)[:\s]*R?\$?\s*(\d{1,6}[,.]?\d{2})',
-            r'(?:TOTAL|VALOR)[:\s]*R?\$?\s*(\d{1,6}[,.]?\d{2})',
-            # Padrões com R$
-            r'R\$\s*(\d{1,6}[,.]?\d{2})',
-            r'RS\s*(\d{1,6}[,.]?\d{2})',
-            # Valores no final de linhas
-            r'(\d{1,6}[,.]?\d{2})\s*$',
-            # Valores isolados com formato monetário
-            r'(?:^|\s)(\d{1,4}[,.]\d{2})(?:\s|$)',
-        ]
-        
         valores_encontrados = []
         
         # Processa linha por linha
@@ -128,11 +236,18 @@ class OCRAws:
         
         for linha in linhas:
             linha = linha.strip()
-            if not linha:
+            if not linha or not _RE_CANDIDATO_VALOR.search(linha):
                 continue
                 
-            for padrao in padroes_valor:
-                matches = re.findall(padrao, linha, re.IGNORECASE)
+            # Peso dado pelo contexto da linha (igual para todos os valores dela)
+            peso_linha = 1
+            if _RE_TOTAL.search(linha):
+                peso_linha += 10
+            if _RE_REAIS.search(linha):
+                peso_linha += 5
+            
+            for padrao in _PADROES_VALOR:
+                matches = padrao.findall(linha)
                 for match in matches:
                     try:
                         # Trata diferentes formatos de decimal
@@ -146,17 +261,12 @@ class OCRAws:
                         
                         # Filtra valores válidos
                         if 0.01 <= valor <= 999999.99:
-                            peso = 1
-                            linha_upper = linha.upper()
+                            peso = peso_linha
                             
-                            # Aumenta peso baseado no contexto
-                            if any(palavra in linha_upper for palavra in ['TOTAL', 'VALOR TOTAL', 'TOTAL GERAL']):
-                                peso += 10
-                            if 'R$' in linha or 'RS' in linha:
-                                peso += 5
-                            if linha.strip().endswith(f'{valor:.2f}'.replace('.', ',')):
+                            # Aumenta peso se o valor fecha a linha
+                            if linha.endswith(f'{valor:.2f}'.replace('.', ',')):
                                 peso += 3
-                                
+                            
                             valores_encontrados.append((valor, peso))
                             
                     except ValueError:
@@ -169,35 +279,51 @@ class OCRAws:
         valores_encontrados.sort(key=lambda x: (x[1], x[0]), reverse=True)
         return valores_encontrados[0][0]
     
-    def extrair_dados_canhoto(self, caminho_imagem: str) -> Dict:
+    def extrair_dados_canhoto(self, caminho_imagem: str, exibir: bool = True) -> Dict:
         """
         Função principal para extrair CNPJ e valor total de um canhoto.
         
         Args:
             caminho_imagem: Caminho para o arquivo de imagem
+            exibir: Se False, não imprime nada e propaga erros do Textract,
+                para quem processa várias imagens em paralelo e exibe os
+                resultados depois
             
         Returns:
             Dicionário com 'cnpj', 'valor' e 'texto_completo'
         """
+        if not exibir:
+            if self.bucket_s3:
+                return self._analisar_texto(self._detectar_texto_s3(caminho_imagem))
+            return self._analisar_texto(self._detectar_texto_aws(caminho_imagem))
+        
         print(f"🔍 Processando: {os.path.basename(caminho_imagem)}")
         
         # Extrai texto da imagem usando AWS Textract
-        texto = self.extrair_texto_aws(caminho_imagem)
+        if self.bucket_s3:
+            texto = self.extrair_texto_s3(caminho_imagem)
+        else:
+            texto = self.extrair_texto_aws(caminho_imagem)
         
         if not texto:
             print(f"  ⚠️  Não foi possível extrair texto da imagem")
-            return {'cnpj': None, 'valor': 0.0, 'texto_completo': ''}
+            return self._analisar_texto(texto)
+        
+        dados = self._analisar_texto(texto)
         
-        # Extrai CNPJ e valor
-        cnpj = self.extrair_cnpj(texto)
-        valor = self.extrair_valor_total(texto)
+        print(f"  📄 CNPJ: {dados['cnpj'] if dados['cnpj'] else 'Não encontrado'}")
+        print(f"  💰 Valor: R$ {dados['valor']:.2f}")
         
-        print(f"  📄 CNPJ: {cnpj if cnpj else 'Não encontrado'}")
-        print(f"  💰 Valor: R$ {valor:.2f}")
+        return dados
+    
+    def _analisar_texto(self, texto: str) -> Dict:
+        """Extrai CNPJ e valor do texto do canhoto."""
+        if not texto:
+            return {'cnpj': None, 'valor': 0.0, 'texto_completo': ''}
         
         return {
-            'cnpj': cnpj,
-            'valor': valor,
+            'cnpj': self.extrair_cnpj(texto),
+            'valor': self.extrair_valor_total(texto),
             'texto_completo': texto
         }
 